@@ -0,0 +1,825 @@
+#!/usr/bin/env python3
+"""
+Shared HTTP server machinery for the annotation interfaces.
+Each run_*_server.py describes its endpoint and CSV layout with an AnnotationSpec,
+then calls run() to serve it; one server can take several specs on different endpoints.
+"""
+
+import atexit
+import csv
+import email.utils
+import errno
+import http.server
+from http import HTTPStatus
+import socketserver
+import os
+import json
+import logging
+import logging.handlers
+import fcntl
+import gzip
+import io
+import signal
+import socket
+import stat
+import sys
+import queue
+import selectors
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import timezone
+from pathlib import Path
+from urllib.parse import urlparse
+
+# orjson parses bytes/memoryviews and serializes straight to bytes; fall back to the stdlib when it is not installed
+try:
+    import orjson
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+except ImportError:
+    def _json_loads(data):
+        return json.loads(bytes(data))
+    def _json_dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+HTTP_THREADS = int(os.environ.get('HTTP_THREADS', 32))
+# Number of server processes sharing the port through SO_REUSEPORT
+HTTP_WORKERS = int(os.environ.get('HTTP_WORKERS', 1))
+# Seconds an idle keep-alive connection is kept open; idle connections wait in the server's
+# selector rather than on a pool thread, so this only costs a file descriptor each
+KEEPALIVE_TIMEOUT = float(os.environ.get('KEEPALIVE_TIMEOUT', 5))
+# A save is acknowledged once its CSV batch has been written, so any worker process serving
+# the CSV next already has the row; with DURABLE_WRITES=true the batch is also fsync()ed first,
+# one fsync covering every annotation in the batch
+DURABLE_WRITES = os.environ.get('DURABLE_WRITES') == 'true'
+# Per-request messages are logged at INFO; set LOG_LEVEL=INFO to see them
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'WARNING').upper()
+
+log = logging.getLogger('annotation_server')
+
+# CORS headers added to every response
+CORS_HEADERS = (
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Methods', 'GET, POST, OPTIONS'),
+    ('Access-Control-Allow-Headers', '*'),
+)
+_CORS_PREAMBLE = ''.join(f"{name}: {value}\r\n" for name, value in CORS_HEADERS)
+
+# Static assets that are precompressed at startup and sent gzip-encoded when the client accepts it;
+# an asset edited after startup is sent uncompressed until the next start refreshes its .gz
+GZIP_SUFFIXES = ('.html', '.js', '.css')
+
+# Directory holding the split CSVs and their JSONL logs, relative to the script directory;
+# created once in run()
+ANNOTATIONS_DIR = Path('annotations')
+# Directories whose CSV files are served under /annotations/ and /answer/
+SERVED_DIRS = (ANNOTATIONS_DIR, Path('answer'))
+
+# Annotation payloads are well under 1 KiB; larger POST bodies are rejected unread
+MAX_BODY_SIZE = 16 * 1024
+
+# Per-thread MAX_BODY_SIZE scratch buffer that request bodies are read into
+_scratch = threading.local()
+
+# One (JSONL log fd, log lock, line queue) triple and writer thread per CSV file, so appends to
+# different splits never wait on each other; each queue holds (line, future) items, the future
+# resolving once the line is in the CSV, and is drained in batches of up to MAX_WRITE_BATCH.
+# Each process logs to its own <split>.<pid>.jsonl, which its writer empties whenever
+# everything logged has reached the CSV, so the log only holds rows the CSV may be missing
+_writers = {}
+_writers_lock = threading.Lock()
+MAX_WRITE_BATCH = 64
+# Seconds a writer lingers after a batch's first row for more rows to join it, so one write
+# (and with DURABLE_WRITES one fsync) covers them, at the cost of up to this much save latency;
+# 0 writes whatever is queued right away
+WRITE_BATCH_WINDOW = float(os.environ.get('WRITE_BATCH_WINDOW', 0.05))
+
+# Append-only CSV and JSONL file descriptors kept open for the server lifetime; each CSV
+# is only written by its own writer thread
+_open_files = {}
+
+# Contents of served /annotations/ and /answer/ files, keyed by resolved path and reused while
+# their (mtime, size) is unchanged: path -> (mtime_ns, size, data)
+_file_cache = {}
+_file_cache_lock = threading.Lock()
+
+def _read_cached(file_path, st):
+    """Return file_path's bytes, rereading only if the stat result shows it changed"""
+    entry = _file_cache.get(file_path)
+    if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+        return entry[2]
+    
+    data = file_path.read_bytes()
+    with _file_cache_lock:
+        _file_cache[file_path] = (st.st_mtime_ns, st.st_size, data)
+    return data
+
+def _precompress_static_files(root):
+    """Write a .gz copy next to each static asset whose .gz is missing or older than the source"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        # Skip hidden directories such as .git
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for name in filenames:
+            if not name.endswith(GZIP_SUFFIXES):
+                continue
+            path = Path(dirpath) / name
+            gz_path = path.with_name(name + '.gz')
+            if not gz_path.exists() or gz_path.stat().st_mtime < path.stat().st_mtime:
+                tmp_path = gz_path.with_name(gz_path.name + '.tmp')
+                tmp_path.write_bytes(gzip.compress(path.read_bytes(), mtime=0))
+                os.replace(tmp_path, gz_path)
+
+def _csv_text(value):
+    """Return the text csv.writer writes for value, which for None is an empty field"""
+    return '' if value is None else str(value)
+
+def _csv_field(value):
+    """Quote a CSV field only if it contains a delimiter, quote or line break (like csv.QUOTE_MINIMAL)"""
+    value = _csv_text(value)
+    if ',' in value or '"' in value or '\n' in value or '\r' in value:
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+def _format_row(values):
+    """Encode one CSV line, byte-for-byte what csv.writer would produce"""
+    return (','.join(map(_csv_field, values)) + '\r\n').encode('utf-8')
+
+def _write_all(fd, buffers):
+    """Write buffers to fd with one writev, finishing a short write the way a buffered file would"""
+    written = os.writev(fd, buffers)
+    total = sum(map(len, buffers))
+    if written < total:
+        rest = memoryview(b''.join(buffers))[written:]
+        while rest:
+            n = os.write(fd, rest)
+            if n == 0:
+                raise OSError(errno.ENOSPC, "No progress writing file", fd)
+            rest = rest[n:]
+
+def _close_open_files():
+    """Close all cached CSV and JSONL files on interpreter exit"""
+    for fd in _open_files.values():
+        os.close(fd)
+
+atexit.register(_close_open_files)
+
+def _open_csv(csv_file, header):
+    """Open csv_file for appending, writing the header first if the file is new"""
+    fd = os.open(csv_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    
+    # Lock the file (Unix/Linux/Mac) just for the header check, so worker processes
+    # opening the same new file can't both write a header
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        if os.fstat(fd).st_size == 0:
+            _write_all(fd, (header,))
+            log.info("📁 Created new annotation file: %s", csv_file)
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    
+    _open_files[csv_file] = fd
+    return fd
+
+def _csv_writer_loop(csv_file, fd, wal_fd, wal_lock, write_q):
+    """Append csv_file's queued lines to its descriptor fd, one write per batch"""
+    # Set once a batch fails to reach the CSV; its rows then exist only in the log, which
+    # is kept from then on so the next start can replay them
+    failed = False
+    while True:
+        batch = [write_q.get()]
+        deadline = time.monotonic() + WRITE_BATCH_WINDOW
+        while len(batch) < MAX_WRITE_BATCH:
+            try:
+                batch.append(write_q.get(timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        
+        try:
+            # One gathered write per batch, without first joining the lines into a new buffer,
+            # appended at the current end of file thanks to O_APPEND; _write_all finishes the
+            # rare short write (e.g. interrupted) with further writes and raises on errors.
+            # Other worker processes may append to the same split, and one of their batches
+            # could land between those writes, so with several workers the batch holds the
+            # file lock throughout
+            if HTTP_WORKERS > 1:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                _write_all(fd, [line for line, _ in batch])
+            finally:
+                if HTTP_WORKERS > 1:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+            if DURABLE_WRITES:
+                os.fsync(fd)
+            
+            # Rows are logged and queued under wal_lock, so with the queue empty and no
+            # earlier batch lost every logged row is in the CSV and the log can be emptied
+            if not failed:
+                with wal_lock:
+                    if write_q.empty():
+                        os.ftruncate(wal_fd, 0)
+        except Exception as e:
+            # The rows are still in the JSONL log, which is no longer emptied, and get
+            # replayed on the next start
+            failed = True
+            log.error("❌ Error writing %s: %s", csv_file, e)
+            for _, future in batch:
+                future.set_exception(e)
+        else:
+            for _, future in batch:
+                future.set_result(None)
+        finally:
+            for _ in batch:
+                write_q.task_done()
+
+def _get_writer(csv_file, header):
+    """Return csv_file's (JSONL log fd, log lock, line queue), opening both files and starting its writer thread on first use"""
+    writer = _writers.get(csv_file)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(csv_file)
+            if writer is None:
+                wal_file = csv_file.with_name(f'{csv_file.stem}.{os.getpid()}.jsonl')
+                wal_fd = _open_files[wal_file] = os.open(wal_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                csv_fd = _open_csv(csv_file, header)
+                wal_lock = threading.Lock()
+                write_q = queue.Queue()
+                threading.Thread(target=_csv_writer_loop, args=(csv_file, csv_fd, wal_fd, wal_lock, write_q),
+                                 daemon=True).start()
+                writer = _writers[csv_file] = (wal_fd, wal_lock, write_q)
+    return writer
+
+def _lock_annotations(annotations_dir, spec):
+    """Take spec's lock file for the life of the server; return False if another server holds it"""
+    # The lock is a dotfile, so the <prefix>* globs and the .csv-only GET route never see it.
+    # Forked workers inherit the descriptor, and the lock lasts until every process has exited
+    lock_file = annotations_dir / f'.{spec.prefix}.lock'
+    fd = os.open(lock_file, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+    _open_files[lock_file] = fd
+    return True
+
+def _replay_wal(annotations_dir, spec):
+    """Append rows found in spec's JSONL logs but missing from their CSV files, then drop the logs"""
+    for wal_file in annotations_dir.glob(f'{spec.prefix}*.jsonl'):
+        # <split>.<pid>.jsonl belongs to <split>.csv
+        csv_file = wal_file.with_name(wal_file.name.split('.', 1)[0] + '.csv')
+        
+        saved = Counter()
+        if csv_file.exists():
+            data = csv_file.read_bytes()
+            # A last row without its line ending was cut off mid-write; drop it so rows
+            # appended below start on a fresh line, and let the log supply it again
+            if not data.endswith(b'\n'):
+                data = data[:data.rfind(b'\n') + 1]
+                os.truncate(csv_file, len(data))
+            saved.update(tuple(row) for row in csv.reader(io.StringIO(data.decode('utf-8'), newline='')))
+        
+        # A line without its newline was cut off mid-write and never acknowledged
+        with open(wal_file, 'rb') as f:
+            logged = [_json_loads(line) for line in f if line.endswith(b'\n')]
+        
+        # Count matches so repeated identical rows are each accounted for; logged values
+        # are compared as the text they were written to the CSV as
+        missing = []
+        for row in logged:
+            key = tuple(map(_csv_text, row))
+            if saved[key]:
+                saved[key] -= 1
+            else:
+                missing.append(row)
+        
+        if missing:
+            fd = _open_csv(csv_file, spec.header)
+            _write_all(fd, (b''.join(map(_format_row, missing)),))
+            os.close(_open_files.pop(csv_file))
+            print(f"♻️  Recovered {len(missing)} {spec.name}s into {csv_file}")
+        
+        wal_file.unlink()
+
+def _start_writers(annotations_dir, spec):
+    """Open the files and start the writer threads for spec's existing split CSVs ahead of the first request"""
+    for csv_file in annotations_dir.glob(f'{spec.prefix}*.csv'):
+        split = csv_file.stem[len(spec.prefix):]
+        if split.isdigit() and int(split) in spec.splits:
+            _get_writer(csv_file, spec.header)
+
+@dataclass
+class AnnotationSpec:
+    """One annotation type: the endpoint it is posted to and how it is stored"""
+    # POST path, e.g. '/save_annotation'
+    endpoint: str
+    # CSV filename prefix; rows go to annotations/<prefix><split>.csv
+    prefix: str
+    # Human-readable annotation type used in messages, e.g. 'emotion annotation'
+    name: str
+    # Keys that must be present in the posted JSON
+    required: frozenset
+    # CSV header columns, and the JSON keys that fill them in the same order
+    fields: list
+    row_keys: list
+    # Split numbers the frontend may post, e.g. range(1, 7); each gets its own CSV file
+    splits: range
+    # JSON keys echoed in the success log line
+    log_keys: list = ()
+    # Precomputed CSV header line and success response body
+    header: bytes = field(init=False, repr=False)
+    success_body: bytes = field(init=False, repr=False)
+    
+    def __post_init__(self):
+        self.header = _format_row(self.fields)
+        self.success_body = _json_dumps({"status": "success", "message": f"{self.name.capitalize()} saved successfully"})
+
+class ThreadPoolHTTPServer(socketserver.TCPServer):
+    """TCP server that handles requests on a fixed pool of HTTP_THREADS worker threads
+
+    A pool thread serves one request at a time; between requests a kept-alive
+    connection is parked in a selector, so idle connections never tie up the pool.
+    """
+    allow_reuse_address = True
+    # Listen backlog; the default of 5 drops connections when many annotators submit at once
+    request_queue_size = 128
+    
+    def __init__(self, server_address, handler_cls, specs):
+        super().__init__(server_address, handler_cls)
+        # Annotation types served, keyed by their POST endpoint
+        self.specs = {spec.endpoint: spec for spec in specs}
+        self._pool = ThreadPoolExecutor(max_workers=HTTP_THREADS)
+        
+        # Parked connections: socket -> (handler, idle deadline); registering while the
+        # idle thread is in select() takes effect at once with epoll/kqueue
+        self._idle = selectors.DefaultSelector()
+        self._idle_lock = threading.Lock()
+        self._closed = False
+        threading.Thread(target=self._idle_loop, daemon=True).start()
+    
+    def server_bind(self):
+        # Let every worker process bind the same port; the kernel spreads connections across them
+        if HTTP_WORKERS > 1:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+    
+    def process_request(self, request, client_address):
+        """Hand the request to a pooled thread instead of spawning a new one"""
+        self._pool.submit(self.process_request_thread, request, client_address)
+    
+    def finish_request(self, request, client_address):
+        """Serve the connection's first request and return its handler"""
+        return self.RequestHandlerClass(request, client_address, self)
+    
+    def process_request_thread(self, request, client_address):
+        """Like ThreadingMixIn.process_request_thread, but parks kept-alive connections"""
+        try:
+            handler = self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+            self.shutdown_request(request)
+            return
+        self._park_or_close(handler)
+    
+    def _resume(self, handler):
+        """Serve the next request on a parked connection that has become readable"""
+        try:
+            handler.resume()
+        except Exception:
+            handler.keep_alive = False
+            self.handle_error(handler.request, handler.client_address)
+        self._park_or_close(handler)
+    
+    def _park_or_close(self, handler):
+        """Hand a kept-alive connection to the idle thread, or close it"""
+        if handler.keep_alive:
+            with self._idle_lock:
+                if not self._closed:
+                    self._idle.register(handler.request, selectors.EVENT_READ,
+                                        (handler, time.monotonic() + KEEPALIVE_TIMEOUT))
+                    return
+        self._close_handler(handler)
+    
+    def _close_handler(self, handler):
+        """Close a connection's socket files and the socket itself"""
+        handler.keep_alive = False
+        try:
+            handler.finish()
+        except Exception:
+            pass
+        self.shutdown_request(handler.request)
+    
+    def _idle_loop(self):
+        """Resume parked connections on the pool when readable; close those idle past KEEPALIVE_TIMEOUT"""
+        while not self._closed:
+            ready = [key.fileobj for key, _ in self._idle.select(timeout=1)]
+            
+            now = time.monotonic()
+            resume, expired = [], []
+            with self._idle_lock:
+                if self._closed:
+                    break
+                for key in list(self._idle.get_map().values()):
+                    handler, deadline = key.data
+                    if key.fileobj in ready:
+                        resume.append(handler)
+                    elif deadline <= now:
+                        expired.append(handler)
+                    else:
+                        continue
+                    self._idle.unregister(key.fileobj)
+            
+            for handler in expired:
+                self._close_handler(handler)
+            for handler in resume:
+                try:
+                    self._pool.submit(self._resume, handler)
+                except RuntimeError:
+                    # The pool has been shut down
+                    self._close_handler(handler)
+        
+        # Close whatever was still parked when the server shut down
+        with self._idle_lock:
+            parked = [key.data[0] for key in self._idle.get_map().values()]
+            self._idle.close()
+        for handler in parked:
+            self._close_handler(handler)
+    
+    def server_close(self):
+        super().server_close()
+        with self._idle_lock:
+            self._closed = True
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+class AnnotationHandler(http.server.SimpleHTTPRequestHandler):
+    """Static file server plus the server's spec endpoints, which append annotations to split CSVs"""
+    # Keep connections open across an annotator's requests; every response carries Content-Length.
+    # Between requests the server parks the connection (see ThreadPoolHTTPServer); timeout only
+    # bounds reads within a request
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    timeout = KEEPALIVE_TIMEOUT
+    
+    # Whether the connection stays open for another request once handle() returns
+    keep_alive = False
+    # Set while do_GET hands an asset with a gzip variant to SimpleHTTPRequestHandler
+    vary_encoding = False
+    
+    def handle(self):
+        """Serve the request waiting on this connection, plus any already buffered behind it"""
+        self.keep_alive = False
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self._input_buffered():
+            self.handle_one_request()
+        self.keep_alive = not self.close_connection
+    
+    def finish(self):
+        # A parked connection keeps its socket files for the next request
+        if not self.keep_alive:
+            super().finish()
+    
+    def resume(self):
+        """Serve the next request on a parked connection"""
+        try:
+            self.handle()
+        finally:
+            self.finish()
+    
+    def _input_buffered(self):
+        """Return whether the next request has already arrived, without blocking"""
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+    
+    def log_message(self, format, *args):
+        """Send the per-request access log through the queued logger"""
+        log.info("%s - - [%s] %s", self.address_string(), self.log_date_time_string(), format % args)
+    
+    def log_error(self, format, *args):
+        """Log send_error() responses at WARNING so they stay visible by default"""
+        # Idle keep-alive connections timing out are routine, not errors
+        if format.startswith("Request timed out"):
+            log.info("%s - - [%s] %s", self.address_string(), self.log_date_time_string(), format % args)
+            return
+        log.warning("%s - - [%s] %s", self.address_string(), self.log_date_time_string(), format % args)
+    
+    def end_headers(self):
+        # Add CORS headers
+        for name, value in CORS_HEADERS:
+            self.send_header(name, value)
+        if self.vary_encoding:
+            self.send_header('Vary', 'Accept-Encoding')
+        super().end_headers()
+    
+    def _write_response(self, status, body=b'', content_type='application/json', headers=()):
+        """Send the status line, headers and body to the client in a single write"""
+        self.log_request(status)
+        preamble = f"{self.protocol_version} {status} {HTTPStatus(status).phrase}\r\n"
+        if content_type:
+            preamble += f"Content-Type: {content_type}\r\n"
+        for name, value in headers:
+            preamble += f"{name}: {value}\r\n"
+        # A 304 describes the cached body, so it must not claim a length of 0
+        if status != 304:
+            preamble += f"Content-Length: {len(body)}\r\n"
+        preamble += f"{_CORS_PREAMBLE}\r\n"
+        self.wfile.write(preamble.encode('latin-1') + body)
+    
+    def do_OPTIONS(self):
+        """Handle preflight requests"""
+        self._write_response(200, content_type=None)
+    
+    def do_GET(self):
+        """Handle GET requests"""
+        parsed_path = urlparse(self.path)
+        
+        # Serve annotation files for accuracy calculation
+        if parsed_path.path.startswith('/annotations/') or parsed_path.path.startswith('/answer/'):
+            # Only the CSV files are served; the JSONL logs next to them stay private
+            if not parsed_path.path.endswith('.csv'):
+                self.send_error(404, "File not found")
+                return
+            
+            try:
+                # Resolve the path and refuse anything that escapes the served directories,
+                # e.g. /annotations/../secret.csv or a symlink pointing elsewhere
+                file_path = Path(parsed_path.path[1:]).resolve()  # Remove leading '/'
+                if not any(file_path.is_relative_to(d.resolve()) for d in SERVED_DIRS):
+                    self.send_error(404, "File not found")
+                    return
+                
+                try:
+                    st = file_path.stat()
+                except FileNotFoundError:
+                    st = None
+                
+                if st is not None and stat.S_ISREG(st.st_mode):
+                    self._write_response(200, _read_cached(file_path, st), 'text/csv')
+                    return
+                else:
+                    self.send_error(404, f"File not found: {parsed_path.path}")
+                    return
+            
+            except Exception as e:
+                log.error("Error serving file: %s", e)
+                self.send_error(500, f"Server error: {e}")
+                return
+        
+        # Serve the precompressed copy of static assets to clients that accept gzip, as long
+        # as it is at least as new as the asset itself
+        if parsed_path.path.endswith(GZIP_SUFFIXES) and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            src_path = Path(self.translate_path(self.path))
+            gz_path = src_path.with_name(src_path.name + '.gz')
+            try:
+                src_st = src_path.stat()
+                gz_st = gz_path.stat()
+            except (FileNotFoundError, NotADirectoryError):
+                gz_st = None
+            
+            if gz_st is not None and stat.S_ISREG(gz_st.st_mode) and gz_st.st_mtime_ns >= src_st.st_mtime_ns:
+                headers = (
+                    ('Last-Modified', self.date_time_string(src_st.st_mtime)),
+                    ('Vary', 'Accept-Encoding'),
+                )
+                if self._not_modified_since(src_st.st_mtime):
+                    self._write_response(304, content_type=None, headers=headers)
+                else:
+                    self._write_response(200, _read_cached(gz_path, gz_st), self.guess_type(parsed_path.path),
+                                         (('Content-Encoding', 'gzip'),) + headers)
+                return
+        
+        # Default GET handler for regular files; assets with a gzip variant vary by
+        # Accept-Encoding even when sent uncompressed
+        self.vary_encoding = parsed_path.path.endswith(GZIP_SUFFIXES)
+        try:
+            super().do_GET()
+        finally:
+            self.vary_encoding = False
+    
+    def _not_modified_since(self, mtime):
+        """Return whether the request's If-Modified-Since covers mtime, checked like SimpleHTTPRequestHandler does"""
+        if 'If-Modified-Since' not in self.headers or 'If-None-Match' in self.headers:
+            return False
+        try:
+            ims = email.utils.parsedate_to_datetime(self.headers['If-Modified-Since'])
+        except (TypeError, IndexError, OverflowError, ValueError):
+            # Ignore ill-formed values
+            return False
+        if ims.tzinfo is None:
+            ims = ims.replace(tzinfo=timezone.utc)
+        return int(mtime) <= ims.timestamp()
+    
+    def do_POST(self):
+        """Handle POST requests for saving annotations"""
+        parsed_path = urlparse(self.path)
+        
+        spec = self.server.specs.get(parsed_path.path)
+        if spec is not None:
+            self.handle_save_annotation(spec)
+        else:
+            self.send_error(404, "Endpoint not found")
+    
+    def handle_save_annotation(self, spec):
+        """Save an annotation of type spec to CSV file"""
+        # Check the body size before reading so a bad header can't make us allocate a huge buffer
+        content_length = self.headers.get('Content-Length', '')
+        content_length = int(content_length) if content_length.isdigit() else 0
+        if content_length == 0:
+            self.send_error(411, "Content-Length required")
+            return
+        if content_length > MAX_BODY_SIZE:
+            self.send_error(413, f"Annotation larger than {MAX_BODY_SIZE} bytes")
+            return
+        
+        try:
+            # Read request data into this thread's reusable buffer instead of a fresh bytes object
+            buf = getattr(_scratch, 'buf', None)
+            if buf is None:
+                buf = _scratch.buf = bytearray(MAX_BODY_SIZE)
+            post_data = memoryview(buf)[:content_length]
+            if self.rfile.readinto(post_data) != content_length:
+                raise ValueError("Incomplete request body")
+            annotation = _json_loads(post_data)
+            
+            # Validate annotation data with a single set difference
+            missing = spec.required - annotation.keys()
+            if missing:
+                raise ValueError(f"Missing required fields: {', '.join(sorted(missing))}")
+            
+            # Extract split number from the annotation data if available; only the spec's
+            # splits are accepted, since every distinct split gets its own files and writer thread
+            split_number = annotation.get('split', 1)
+            if isinstance(split_number, str) and split_number.isdigit():
+                split_number = int(split_number)
+            if type(split_number) is not int or split_number not in spec.splits:
+                response = {"status": "error", "message": f"Invalid split {json.dumps(split_number)}: expected an integer "
+                                                          f"from {spec.splits.start} to {spec.splits.stop - 1}"}
+                self._write_response(400, _json_dumps(response))
+                return
+            
+            # Save to CSV file
+            self.save_annotation_to_csv(spec, annotation, split_number)
+            
+            # Send success response
+            self._write_response(200, spec.success_body)
+            
+            if log.isEnabledFor(logging.INFO):
+                log.info("✅ Saved %s: %s - %s", spec.name, annotation['user_id'],
+                         ' - '.join(str(annotation[key]) for key in spec.log_keys))
+        
+        except Exception as e:
+            log.error("❌ Error saving %s: %s", spec.name, e)
+            
+            # Send error response
+            response = {"status": "error", "message": str(e)}
+            self._write_response(500, _json_dumps(response))
+    
+    def save_annotation_to_csv(self, spec, annotation, split_number=1):
+        """Log annotation to <prefix><split>.jsonl and queue it for <prefix><split>.csv"""
+        # Generate filename based on split number
+        csv_file = ANNOTATIONS_DIR / f'{spec.prefix}{split_number}.csv'
+        
+        row = [annotation[key] for key in spec.row_keys]
+        record = _json_dumps(row) + b'\n'
+        line = _format_row(row)
+        future = Future()
+        wal_fd, wal_lock, write_q = _get_writer(csv_file, spec.header)
+        
+        # Log the row first so a crash can't lose it, then hand it to the split's writer
+        # thread, which appends it to the CSV file in its next batch
+        with wal_lock:
+            _write_all(wal_fd, (record,))
+            write_q.put((line, future))
+        
+        # Wait until that batch is in the CSV (and in durable mode on disk), so every worker
+        # process serves the row from the moment the save is acknowledged
+        future.result()
+
+def _start_logging():
+    """Route log records through a queue so request threads never block writing to stderr"""
+    log_q = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(log_q, logging.StreamHandler())
+    log.addHandler(logging.handlers.QueueHandler(log_q))
+    log.setLevel(LOG_LEVEL)
+    log.propagate = False
+    listener.start()
+    atexit.register(listener.stop)
+
+def _interrupt(signum, frame):
+    """Turn SIGTERM into the same shutdown path as Ctrl+C"""
+    raise KeyboardInterrupt
+
+def _exit_with_parent(parent_pid):
+    """Terminate this worker process once the parent server process is gone"""
+    while os.getppid() == parent_pid:
+        time.sleep(1)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+def _ignore_stop_signals():
+    """Keep a repeated stop signal from cutting shutdown short
+
+    Ctrl+C reaches the whole process group and the parent then sends its workers SIGTERM
+    as well, which would otherwise interrupt a worker that is already draining its writers.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+def _drain_writers():
+    """Wait until every writer has appended what is queued, so a clean stop leaves the CSVs complete"""
+    for _, _, write_q in list(_writers.values()):
+        write_q.join()
+
+def run(specs, port, home_page, description, saved_to):
+    """Serve the given AnnotationSpecs on all interfaces until interrupted"""
+    # Change to the script directory
+    os.chdir(Path(__file__).parent)
+    
+    _precompress_static_files(Path('.'))
+    
+    # Create annotations directory if it doesn't exist, then finish any CSV writes
+    # a previous run logged but didn't get to. Replay would delete the live logs of a server
+    # still running on these files (with HTTP_WORKERS > 1 a second one could even share its
+    # port), so the spec's lock is taken first and a second server exits instead
+    ANNOTATIONS_DIR.mkdir(exist_ok=True)
+    for spec in specs:
+        if not _lock_annotations(ANNOTATIONS_DIR, spec):
+            sys.exit(f"❌ Another server is already saving {spec.name}s to {ANNOTATIONS_DIR}/{spec.prefix}*.csv")
+        _replay_wal(ANNOTATIONS_DIR, spec)
+    
+    # Fork the extra worker processes before any threads exist; each binds its own
+    # SO_REUSEPORT socket and runs its own writer threads, appending to the shared CSVs under flock
+    parent_pid = os.getpid()
+    workers = []
+    for _ in range(HTTP_WORKERS - 1):
+        pid = os.fork()
+        if pid == 0:
+            workers = None
+            break
+        workers.append(pid)
+    is_parent = workers is not None
+    
+    # systemd, docker and kill send SIGTERM; every process then stops like on Ctrl+C, the
+    # parent stopping its workers on the way out, and a worker whose parent died without
+    # doing so (e.g. SIGKILL) stops by itself
+    signal.signal(signal.SIGTERM, _interrupt)
+    if not is_parent:
+        threading.Thread(target=_exit_with_parent, args=(parent_pid,), daemon=True).start()
+    
+    _start_logging()
+    
+    # Writer threads don't survive fork(), so every process starts its own
+    for spec in specs:
+        _start_writers(ANNOTATIONS_DIR, spec)
+    
+    # Create thread-pool server for concurrent users (bind to all interfaces for deployment)
+    with ThreadPoolHTTPServer(("0.0.0.0", port), AnnotationHandler, specs) as httpd:
+        if not is_parent:
+            try:
+                httpd.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                _ignore_stop_signals()
+                _drain_writers()
+            return
+        
+        print(f"🚀 Starting {description} server at http://localhost:{port}")
+        print(f"📁 Serving files from: {os.getcwd()}")
+        if DURABLE_WRITES:
+            print("🔒 Durable writes: saves are acknowledged after fsync (DURABLE_WRITES)")
+        print(f"🧵 Handling requests on {HTTP_WORKERS} process(es) x {HTTP_THREADS} worker threads (HTTP_WORKERS, HTTP_THREADS)")
+        print(f"📊 Open: http://localhost:{port}/{home_page}")
+        print(f"💾 {' and '.join(spec.name for spec in specs).capitalize()}s will be saved to: {saved_to}")
+        print(f"⏹️  Press Ctrl+C to stop the server")
+        
+        # Only open browser automatically in local development; webbrowser is imported
+        # here so production processes never load it
+        if os.environ.get('DEVELOPMENT') == 'true':
+            try:
+                import webbrowser
+                webbrowser.open(f'http://localhost:{port}/{home_page}')
+                print("🌐 Opened browser automatically")
+            except:
+                print("❌ Could not open browser automatically")
+        
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            print("\n⏹️  Server stopped")
+        finally:
+            _ignore_stop_signals()
+            # Stop the worker processes along with the parent
+            for pid in workers:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+                os.waitpid(pid, 0)
+            _drain_writers()
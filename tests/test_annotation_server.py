@@ -0,0 +1,335 @@
+"""
+Tests for the CSV formatting, writes and JSONL log replay in annotation_server, and for
+its HTTP server and handler running on an ephemeral port.
+Run with: python -m unittest discover tests
+"""
+
+import csv
+import errno
+import http.client
+import io
+import json
+import os
+import queue
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import annotation_server
+from annotation_server import (AnnotationHandler, AnnotationSpec, ThreadPoolHTTPServer, _format_row,
+                               _lock_annotations, _replay_wal, _write_all)
+
+SPEC = AnnotationSpec(
+    endpoint='/save_test_annotation',
+    prefix='test_split',
+    name='test annotation',
+    required=frozenset(['a', 'b']),
+    fields=['A', 'B'],
+    row_keys=['a', 'b'],
+    splits=range(1, 3),
+)
+HOME = b'<p>home</p>'
+
+class FormatRowTest(unittest.TestCase):
+    def test_matches_csv_writer(self):
+        rows = [
+            ['plain', 1, 2.5, True, None, ''],
+            ['a,b', 'say "hi"', 'two\nlines', 'cr\rhere', ' spaced ', 'ünïcode'],
+        ]
+        for row in rows:
+            expected = io.StringIO()
+            csv.writer(expected).writerow(row)
+            self.assertEqual(_format_row(row), expected.getvalue().encode('utf-8'))
+
+class ReplayWalTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self._tmp.name)
+        self.csv_file = self.dir / 'test_split1.csv'
+    
+    def tearDown(self):
+        self._tmp.cleanup()
+    
+    def write_log(self, rows, tail=b'', pid=123):
+        """Write rows as a <split>.<pid>.jsonl log, optionally followed by a torn tail"""
+        wal_file = self.dir / f'test_split1.{pid}.jsonl'
+        wal_file.write_bytes(b''.join(json.dumps(row).encode() + b'\n' for row in rows) + tail)
+        return wal_file
+    
+    def replay(self):
+        _replay_wal(self.dir, SPEC)
+        return self.csv_file.read_bytes()
+    
+    def test_appends_missing_rows_and_removes_log(self):
+        self.csv_file.write_bytes(b'A,B\r\nx,1\r\n')
+        wal_file = self.write_log([['x', '1'], ['y', '2']])
+        
+        self.assertEqual(self.replay(), b'A,B\r\nx,1\r\ny,2\r\n')
+        self.assertFalse(wal_file.exists())
+    
+    def test_creates_missing_csv_with_header(self):
+        self.write_log([['x', 1]])
+        
+        self.assertEqual(self.replay(), b'A,B\r\nx,1\r\n')
+    
+    def test_repeated_rows_are_matched_one_for_one(self):
+        self.csv_file.write_bytes(b'A,B\r\nx,1\r\n')
+        self.write_log([['x', '1'], ['x', '1']])
+        
+        self.assertEqual(self.replay(), b'A,B\r\nx,1\r\nx,1\r\n')
+    
+    def test_torn_csv_row_is_dropped_and_replayed(self):
+        self.csv_file.write_bytes(b'A,B\r\nx,1\r\ny,')
+        self.write_log([['y', '2']])
+        
+        self.assertEqual(self.replay(), b'A,B\r\nx,1\r\ny,2\r\n')
+    
+    def test_null_matches_empty_field(self):
+        self.csv_file.write_bytes(b'A,B\r\nx,\r\n')
+        self.write_log([['x', None]])
+        
+        self.assertEqual(self.replay(), b'A,B\r\nx,\r\n')
+    
+    def test_torn_log_line_is_skipped(self):
+        self.csv_file.write_bytes(b'A,B\r\n')
+        self.write_log([['x', '1']], tail=b'["y", ')
+        
+        self.assertEqual(self.replay(), b'A,B\r\nx,1\r\n')
+    
+    def test_logs_from_several_processes_are_merged(self):
+        self.csv_file.write_bytes(b'A,B\r\n')
+        self.write_log([['x', '1']], pid=1)
+        self.write_log([['y', '2']], pid=2)
+        
+        self.assertEqual(sorted(self.replay().splitlines()), [b'A,B', b'x,1', b'y,2'])
+        self.assertEqual(list(self.dir.glob('*.jsonl')), [])
+
+class LockAnnotationsTest(unittest.TestCase):
+    def test_second_server_is_refused(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertTrue(_lock_annotations(Path(tmp), SPEC))
+            try:
+                self.assertFalse(_lock_annotations(Path(tmp), SPEC))
+            finally:
+                os.close(annotation_server._open_files.pop(Path(tmp) / '.test_split.lock'))
+
+class WriterLoopTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self._tmp.name)
+        self.csv_file = self.dir / 'test_split1.csv'
+        self.wal_file = self.dir / 'test_split1.123.jsonl'
+        self.csv_file.write_bytes(SPEC.header)
+        self.fd = os.open(self.csv_file, os.O_WRONLY | os.O_APPEND)
+        self.wal_fd = os.open(self.wal_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.wal_lock = threading.Lock()
+        self.write_q = queue.Queue()
+        with mock.patch.object(annotation_server, 'WRITE_BATCH_WINDOW', 0):
+            threading.Thread(target=annotation_server._csv_writer_loop, daemon=True,
+                             args=(self.csv_file, self.fd, self.wal_fd, self.wal_lock, self.write_q)).start()
+    
+    def tearDown(self):
+        os.close(self.fd)
+        os.close(self.wal_fd)
+        self._tmp.cleanup()
+    
+    def save(self, row):
+        """Log and queue row the way save_annotation_to_csv does, then wait for its batch"""
+        future = Future()
+        with self.wal_lock:
+            os.write(self.wal_fd, json.dumps(row).encode() + b'\n')
+            self.write_q.put((_format_row(row), future))
+        return future.exception(timeout=5)
+    
+    def test_failed_row_stays_logged_after_later_success(self):
+        real_write_all = annotation_server._write_all
+        calls = []
+        def write_all(fd, buffers):
+            calls.append(fd)
+            if len(calls) == 1:
+                raise OSError(errno.ENOSPC, "No space left on device")
+            real_write_all(fd, buffers)
+        
+        with mock.patch.object(annotation_server, '_write_all', side_effect=write_all):
+            self.assertIsInstance(self.save(['x', '1']), OSError)
+            self.assertIsNone(self.save(['y', '2']))
+        
+        self.assertEqual(self.csv_file.read_bytes(), b'A,B\r\ny,2\r\n')
+        _replay_wal(self.dir, SPEC)
+        self.assertEqual(self.csv_file.read_bytes(), b'A,B\r\ny,2\r\nx,1\r\n')
+
+class WriteAllTest(unittest.TestCase):
+    def test_short_writev_is_finished(self):
+        with tempfile.TemporaryFile() as f:
+            # Let writev land only the first 3 bytes, as an interrupted write might
+            real_writev = os.writev
+            with mock.patch.object(annotation_server.os, 'writev',
+                                   side_effect=lambda fd, bufs: real_writev(fd, [b''.join(bufs)[:3]])):
+                _write_all(f.fileno(), [b'a,1\r\n', b'b,2\r\n'])
+            
+            f.seek(0)
+            self.assertEqual(f.read(), b'a,1\r\nb,2\r\n')
+
+class ServerTestCase(unittest.TestCase):
+    """Runs a ThreadPoolHTTPServer for SPEC on an ephemeral port, serving a temporary directory"""
+    threads = 4
+    keepalive_timeout = 5
+    
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tmp.name)
+        Path('home.html').write_bytes(HOME)
+        Path('annotations').mkdir()
+        
+        for name, value in (('HTTP_THREADS', self.threads), ('KEEPALIVE_TIMEOUT', self.keepalive_timeout)):
+            patcher = mock.patch.object(annotation_server, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(annotation_server.log, 'disabled', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        
+        self.server = ThreadPoolHTTPServer(('127.0.0.1', 0), AnnotationHandler, [SPEC])
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.stop_server)
+    
+    def stop_server(self):
+        self.server.shutdown()
+        self.server.server_close()
+        # Forget this directory's writers; their threads stay blocked on an empty queue
+        annotation_server._drain_writers()
+        annotation_server._writers.clear()
+        for fd in annotation_server._open_files.values():
+            os.close(fd)
+        annotation_server._open_files.clear()
+    
+    def connect(self):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        self.addCleanup(conn.close)
+        return conn
+    
+    def request(self, method, path, body=None, conn=None):
+        """Send one request and return its (status, body)"""
+        conn = conn or self.connect()
+        conn.request(method, path, body)
+        response = conn.getresponse()
+        return response.status, response.read()
+
+class KeepAliveTest(ServerTestCase):
+    threads = 1
+    
+    def test_idle_connections_do_not_block_new_client(self):
+        idle = [self.connect() for _ in range(3)]
+        for conn in idle:
+            self.assertEqual(self.request('GET', '/home.html', conn=conn), (200, HOME))
+        
+        # The single pool thread is free for a new client while the others sit idle
+        conn = self.connect()
+        conn.timeout = 2
+        self.assertEqual(self.request('GET', '/home.html', conn=conn), (200, HOME))
+        # and a parked connection is picked up again when its next request arrives
+        self.assertEqual(self.request('GET', '/home.html', conn=idle[0]), (200, HOME))
+    
+    def test_pipelined_requests_are_all_answered(self):
+        with socket.create_connection(('127.0.0.1', self.port), timeout=5) as sock:
+            sock.sendall(b'GET /home.html HTTP/1.1\r\nHost: localhost\r\n\r\n' * 3)
+            data = b''
+            while data.count(HOME) < 3:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+        
+        self.assertEqual(data.count(b'HTTP/1.1 200 '), 3)
+        self.assertEqual(data.count(HOME), 3)
+
+class KeepAliveTimeoutTest(ServerTestCase):
+    threads = 1
+    keepalive_timeout = 0.2
+    
+    def test_idle_connection_is_closed_after_timeout(self):
+        conn = self.connect()
+        self.assertEqual(self.request('GET', '/home.html', conn=conn), (200, HOME))
+        
+        start = time.monotonic()
+        self.assertEqual(conn.sock.recv(1), b'')
+        # The idle thread checks deadlines at least once a second
+        self.assertLess(time.monotonic() - start, 3)
+
+class StaticFileTest(ServerTestCase):
+    def test_bad_request_line_gets_an_error_response(self):
+        with socket.create_connection(('127.0.0.1', self.port), timeout=5) as sock:
+            sock.sendall(b'GET /home.html HTTP/9.9\r\n\r\n')
+            # The version is rejected before it is known, so the error goes out HTTP/0.9 style, body only
+            self.assertIn(b'Error code: 505', sock.recv(65536))
+    
+    def test_vary_only_on_assets_with_gzip_variant(self):
+        conn = self.connect()
+        conn.request('GET', '/home.html')
+        response = conn.getresponse()
+        response.read()
+        self.assertEqual(response.getheader('Vary'), 'Accept-Encoding')
+        
+        # The same handler serves the next request on this connection
+        conn.request('GET', '/missing.txt')
+        response = conn.getresponse()
+        response.read()
+        self.assertEqual((response.status, response.getheader('Vary')), (404, None))
+
+class AnnotationFilesTest(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        Path('answer').mkdir()
+        Path('answer/key.csv').write_bytes(b'A,B\r\n')
+        Path('secret.csv').write_bytes(b'secret\r\n')
+        Path('annotations/test_split1.123.jsonl').write_bytes(b'["x", "1"]\n')
+        Path('annotations/link.csv').symlink_to(Path('secret.csv').resolve())
+    
+    def test_served_csv(self):
+        self.assertEqual(self.request('GET', '/answer/key.csv'), (200, b'A,B\r\n'))
+    
+    def test_paths_outside_served_directories_are_refused(self):
+        for path in ('/annotations/../secret.csv', '/answer/../secret.csv', '/annotations/../answer/../secret.csv',
+                     '/annotations/link.csv', '/annotations/test_split1.123.jsonl', '/annotations/../run.py'):
+            with self.subTest(path=path):
+                self.assertEqual(self.request('GET', path)[0], 404)
+        
+        secret = Path('secret.csv').resolve()
+        self.assertNotIn(secret, annotation_server._file_cache)
+
+class SaveAnnotationTest(ServerTestCase):
+    def save(self, **annotation):
+        """POST an annotation for SPEC and return the (status, parsed JSON body)"""
+        status, body = self.request('POST', SPEC.endpoint, json.dumps(annotation).encode())
+        return status, json.loads(body)
+    
+    def test_saved_row_is_served_once_acknowledged(self):
+        status, body = self.save(a='x', b='1', split=2)
+        self.assertEqual((status, body['status']), (200, 'success'))
+        
+        self.assertEqual(self.request('GET', '/annotations/test_split2.csv'), (200, b'A,B\r\nx,1\r\n'))
+    
+    def test_split_given_as_digit_string_is_accepted(self):
+        self.assertEqual(self.save(a='x', b='1', split='2')[0], 200)
+    
+    def test_invalid_split_is_rejected(self):
+        for split in (0, 3, -1, None, True, 1.5, '1a', [1]):
+            with self.subTest(split=split):
+                status, body = self.save(a='x', b='1', split=split)
+                self.assertEqual(status, 400)
+                self.assertEqual(body['message'], f"Invalid split {json.dumps(split)}: expected an integer from 1 to 2")
+        self.assertEqual(list(Path('annotations').iterdir()), [])
+
+if __name__ == '__main__':
+    unittest.main()